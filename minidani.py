@@ -4,11 +4,78 @@ MiniDani - Competitive parallel AI development system
 Runs 3 AI coding agents in parallel, judges selects best implementation
 """
 
-import subprocess, json, time, threading, sys, signal, os, shutil
+import subprocess, json, time, threading, sys, signal, os, shutil, collections, functools, hashlib, re, contextlib, fcntl, selectors
 from pathlib import Path
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from datetime import datetime
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional, IO, cast
+from typing import Dict, List, Optional, Set
+
+try:
+    # Optional: much faster on large tool_result events, same results
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+PR_URL_RE = re.compile(r'https://github\.com/[^\s]+/pull/\d+')
+JUDGE_JSON_RE = re.compile(r'\{[^{}]*"scores"[^{}]*\{[^{}]*\}[^{}]*\}', re.DOTALL)
+SLUG_RE = re.compile(r'[^a-z0-9]+')
+LOG_COLORS = {
+    "DEBUG": "\033[90m",    # Gray
+    "LOG": "\033[0m",       # Default
+    "INFO": "\033[36m",     # Cyan
+    "SUCCESS": "\033[32m",  # Green
+    "WARNING": "\033[33m",  # Yellow
+    "ERROR": "\033[31m",    # Red
+}
+LOG_LEVELS = {"DEBUG": 10, "LOG": 20, "INFO": 20, "SUCCESS": 25, "WARNING": 30, "ERROR": 40}
+# tool_use/tool_result events carry big payloads run_oc never reads; match
+# the leading type key only so text that quotes it is never dropped
+TOOL_EVENT_PREFIXES = (b'{"type":"tool', b'{"type": "tool')
+READ_CHUNK_SIZE = 65536
+PIPE_BUFFER_SIZE = 1 << 20
+F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)  # exposed by fcntl only on 3.10+
+MAX_PROMPT_BYTES = 1_000_000
+BRANCH_CACHE = Path(os.getenv("XDG_CACHE_HOME") or Path.home() / ".cache") / "minidani" / "branches.json"
+
+@functools.lru_cache(maxsize=None)
+def find_executable(name: str) -> Optional[str]:
+    """shutil.which, resolved once per process"""
+    return shutil.which(name)
+
+def truncate(s: str, n: int) -> str:
+    """Cut s to n chars plus an ellipsis; short strings are returned as-is"""
+    return s if len(s) <= n else s[:n] + "…"
+
+# OpenCode runs in its own session, so none of these reach it unless we forward them
+INTERRUPT_SIGNALS = (signal.SIGINT, signal.SIGTERM, signal.SIGHUP)
+
+@contextlib.contextmanager
+def interrupt_guard(on_interrupt):
+    """Call on_interrupt(sig) and raise KeyboardInterrupt on the first of INTERRUPT_SIGNALS;
+    later ones are ignored so cleanup can't be cut short. Restores previous handlers on exit.
+    on_interrupt runs inside the signal handler, so it must not block, lock or log"""
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    fired = False
+
+    def handler(sig, frame):
+        nonlocal fired
+        if fired:
+            return
+        fired = True
+        on_interrupt(sig)
+        raise KeyboardInterrupt
+
+    previous = {sig: signal.signal(sig, handler) for sig in INTERRUPT_SIGNALS}
+    try:
+        yield
+    finally:
+        for sig, prev in previous.items():
+            signal.signal(sig, prev)
 
 @dataclass
 class ManagerState:
@@ -37,17 +104,23 @@ class SystemState:
 class MiniDani:
     QUALITY_THRESHOLD = 80
     MANAGER_TIMEOUT = 7200  # 2 hours
+    TERMINATE_GRACE = 10  # seconds between SIGTERM and SIGKILL
     
-    def __init__(self, repo_path: Path, user_prompt: str, branch_prefix: str = "", branch_name: str = "", no_pr: bool = False):
+    def __init__(self, repo_path: Path, user_prompt: str, branch_prefix: str = "", branch_name: str = "", no_pr: bool = False, max_parallel: int = 3):
         self.repo_path = repo_path
         self.user_prompt = user_prompt
         self.branch_prefix = branch_prefix
         self.branch_name = branch_name
         self.no_pr = no_pr
+        self.max_parallel = max_parallel
+        self.log_level = LOG_LEVELS.get(os.getenv("MINIDANI_LOG_LEVEL", "DEBUG").upper(), 0)
         self.lock = threading.Lock()
         self._progress_len = 0
+        self._procs: Set[subprocess.Popen] = set()
+        self._interrupted = False
+        self._interrupt_signal = signal.SIGINT
         
-        self.opencode = shutil.which("opencode")
+        self.opencode = find_executable("opencode")
         if not self.opencode:
             raise FileNotFoundError("OpenCode not found in PATH. Install from https://opencode.ai/docs")
         
@@ -57,38 +130,82 @@ class MiniDani:
             managers={"a": ManagerState("a"), "b": ManagerState("b"), "c": ManagerState("c")}
         )
     
-    def log(self, msg: str, mgr: str = "Sys", lvl: str = "LOG"):
-        colors = {
-            "DEBUG": "\033[90m",    # Gray
-            "LOG": "\033[0m",       # Default
-            "INFO": "\033[36m",     # Cyan
-            "SUCCESS": "\033[32m",  # Green
-            "WARNING": "\033[33m",  # Yellow
-            "ERROR": "\033[31m",    # Red
-        }
+    def log(self, msg: str, *args, mgr: str = "Sys", lvl: str = "LOG"):
+        """Print a log line; msg is %-formatted with args only if lvl passes the filter"""
+        if LOG_LEVELS.get(lvl, 0) < self.log_level:
+            return
+        if args:
+            msg = msg % args
         reset = "\033[0m"
         timestamp = datetime.now().strftime("%H:%M:%S")
-        color = colors.get(lvl, "\033[0m")
+        color = LOG_COLORS.get(lvl, "\033[0m")
         with self.lock:
             if sys.stdout.isatty() and self._progress_len > 0:
-                sys.stdout.write("\r" + (" " * self._progress_len) + "\r")
+                self.write_stdout("\r" + (" " * self._progress_len) + "\r")
                 self._progress_len = 0
-            print(f"{color}[{timestamp}] [{lvl:7s}] [{mgr:8s}] {msg}{reset}")
+            self.write_stdout(f"{color}[{timestamp}] [{lvl:7s}] [{mgr:8s}] {msg}{reset}\n")
+    
+    def write_stdout(self, text: str, flush: bool = False):
+        """Write to stdout, ignoring OSError (e.g. EIO after SIGHUP closed the terminal) so cleanup goes on"""
+        try:
+            sys.stdout.write(text)
+            if flush:
+                sys.stdout.flush()
+        except OSError:
+            pass
+    
+    def terminate_procs(self, procs: List[subprocess.Popen]):
+        """SIGTERM each process group, then SIGKILL any still running after a shared TERMINATE_GRACE"""
+        for proc in procs:
+            try:
+                os.killpg(proc.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.time() + self.TERMINATE_GRACE
+        for proc in procs:
+            try:
+                proc.wait(timeout=max(deadline - time.time(), 0))
+            except subprocess.TimeoutExpired:
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                proc.wait()
+    
+    def signal_all_procs(self, sig: int):
+        """Send sig to every OpenCode process group without waiting; safe in a signal handler"""
+        # No lock: the handler may have interrupted its holder. tuple() copies
+        # the set without releasing the GIL, so it can't see it mid-update.
+        for proc in tuple(self._procs):
+            try:
+                os.killpg(proc.pid, sig)
+            except ProcessLookupError:
+                pass
+    
+    def terminate_all_procs(self):
+        """Terminate every OpenCode process still running; call from normal control flow only"""
+        with self.lock:
+            procs = list(self._procs)
+        if procs:
+            self.log("Waiting for %d OpenCode process(es) to exit", len(procs), lvl="DEBUG")
+            self.terminate_procs(procs)
     
     def run_oc(self, prompt: str, cwd: Optional[Path] = None, timeout: Optional[int] = None, agent: Optional[str] = None, log_prefix: str = "OC"):
         """Run OpenCode with specified agent. Returns (result, error_msg)"""
+        proc = None
         try:
-            import selectors
-
-            self.log(f"Starting {agent or 'opencode'}", mgr=log_prefix, lvl="INFO")
+            with self.lock:
+                if self._interrupted:
+                    return None, "Interrupted"
+            self.log("Starting %s", agent or "opencode", mgr=log_prefix, lvl="INFO")
 
             cmd = [self.opencode, "run", prompt, "--format", "json"]
             if agent:
                 cmd.extend(["--agent", agent])
 
             start = time.time()
-            response_text = ""
-            stderr_lines = []
+            response_parts: List[str] = []
+            stderr_lines: collections.deque = collections.deque(maxlen=20)
 
             proc = subprocess.Popen(
                 cmd,
@@ -96,157 +213,237 @@ class MiniDani:
                 stdin=subprocess.DEVNULL,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
-                text=True,
-                bufsize=1
+                bufsize=0,
+                start_new_session=True
             )
+            # Same lock as terminate_all_procs: either it sees this proc or we see the flag
+            with self.lock:
+                interrupted = self._interrupted
+                if not interrupted:
+                    self._procs.add(proc)
+            if interrupted:
+                self.terminate_procs([proc])
+                return None, "Interrupted"
 
             if proc.stdout is None or proc.stderr is None:
                 return None, "Failed to open subprocess pipes"
 
+            if sys.platform.startswith("linux"):
+                # Widen the kernel pipe so verbose output needs fewer reads
+                for stream in (proc.stdout, proc.stderr):
+                    try:
+                        fcntl.fcntl(stream.fileno(), F_SETPIPE_SZ, PIPE_BUFFER_SIZE)
+                    except OSError:
+                        pass
+
+            # Raw fds + our own line framing: readline() on a buffered stream
+            # can hold complete lines that select() never reports.
             selector = selectors.DefaultSelector()
-            selector.register(proc.stdout, selectors.EVENT_READ)
-            selector.register(proc.stderr, selectors.EVENT_READ)
+            selector.register(proc.stdout, selectors.EVENT_READ, bytearray())
+            selector.register(proc.stderr, selectors.EVENT_READ, bytearray())
 
+            deadline = start + timeout if timeout else None
             while True:
-                if timeout and (time.time() - start) > timeout:
-                    proc.kill()
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    self.terminate_procs([proc])
                     return None, f"Timeout after {timeout}s"
 
-                events = selector.select(timeout=1.0)
-                for key, _ in events:
-                    stream = cast(IO[str], key.fileobj)
-                    line = stream.readline()
-                    if line == "":
-                        try:
-                            selector.unregister(key.fileobj)
-                        except Exception:
-                            pass
+                if not selector.get_map():
+                    # Both pipes closed; wait for the exit in short slices, since an
+                    # untimed wait holds Popen's waitpid lock and starves terminate_procs
+                    try:
+                        proc.wait(timeout=min(remaining or 1.0, 1.0))
+                    except subprocess.TimeoutExpired:
                         continue
+                    break
 
-                    if key.fileobj is proc.stdout:
-                        line = line.strip()
-                        if not line:
-                            continue
-                        try:
-                            event = json.loads(line)
-                            if event.get("type") == "text":
-                                if "content" in event:
-                                    chunk = event["content"]
-                                    response_text += chunk
-                                    if log_prefix.startswith("M"):
-                                        mid = log_prefix[-1].lower()
-                                        if mid in self.state.managers:
-                                            self.state.managers[mid].last_log = chunk[-200:]
-                                            self.state.managers[mid].last_log_at = time.time()
-                                elif "part" in event and "text" in event["part"]:
-                                    chunk = event["part"]["text"]
-                                    response_text += chunk
+                events = selector.select(timeout=remaining)
+                for key, _ in events:
+                    buf = key.data
+                    data = os.read(key.fd, READ_CHUNK_SIZE)
+                    lines = []
+                    if data:
+                        buf += data
+                        # One slice per frame, one compaction per chunk
+                        pos = 0
+                        while True:
+                            nl = buf.find(b"\n", pos)
+                            if nl < 0:
+                                break
+                            lines.append(buf[pos:nl])
+                            pos = nl + 1
+                        del buf[:pos]
+                    else:
+                        selector.unregister(key.fileobj)
+                        if buf:
+                            lines.append(bytes(buf))
+                            buf.clear()
+
+                    for line in lines:
+                        if key.fileobj is proc.stdout:
+                            line = line.strip()
+                            if not line or line.startswith(TOOL_EVENT_PREFIXES):
+                                continue
+                            try:
+                                # Both parsers take UTF-8 bytes directly, no decode pass
+                                event = json_loads(line)
+                                if event.get("type") == "text":
+                                    if "content" in event:
+                                        chunk = event["content"]
+                                        response_parts.append(chunk)
+                                        if log_prefix.startswith("M"):
+                                            mid = log_prefix[-1].lower()
+                                            if mid in self.state.managers:
+                                                self.state.managers[mid].last_log = chunk[-200:]
+                                                self.state.managers[mid].last_log_at = time.time()
+                                    elif "part" in event and "text" in event["part"]:
+                                        chunk = event["part"]["text"]
+                                        response_parts.append(chunk)
+                                        if log_prefix.startswith("M"):
+                                            mid = log_prefix[-1].lower()
+                                            if mid in self.state.managers:
+                                                self.state.managers[mid].last_log = chunk[-200:]
+                                                self.state.managers[mid].last_log_at = time.time()
+                                elif event.get("type") == "message.complete" and "content" in event:
+                                    response_parts = [event["content"]]
+                                elif "response" in event:
+                                    chunk = event["response"]
+                                    response_parts.append(chunk)
                                     if log_prefix.startswith("M"):
                                         mid = log_prefix[-1].lower()
                                         if mid in self.state.managers:
-                                            self.state.managers[mid].last_log = chunk[-200:]
+                                            self.state.managers[mid].last_log = str(chunk)[-200:]
                                             self.state.managers[mid].last_log_at = time.time()
-                            elif event.get("type") == "message.complete" and "content" in event:
-                                response_text = event["content"]
-                            elif "response" in event:
-                                chunk = event["response"]
-                                response_text += chunk
+                            except ValueError:
+                                response_parts.append(line.decode("utf-8", "replace"))
+                        else:
+                            line = line.rstrip().decode("utf-8", "replace")
+                            if line:
+                                stderr_lines.append(line)
                                 if log_prefix.startswith("M"):
                                     mid = log_prefix[-1].lower()
                                     if mid in self.state.managers:
-                                        self.state.managers[mid].last_log = str(chunk)[-200:]
+                                        self.state.managers[mid].last_log = line[-200:]
                                         self.state.managers[mid].last_log_at = time.time()
-                        except json.JSONDecodeError:
-                            response_text += line
-                    else:
-                        line = line.rstrip()
-                        if line:
-                            stderr_lines.append(line)
-                            if log_prefix.startswith("M"):
-                                mid = log_prefix[-1].lower()
-                                if mid in self.state.managers:
-                                    self.state.managers[mid].last_log = line[-200:]
-                                    self.state.managers[mid].last_log_at = time.time()
-
-                if proc.poll() is not None and not selector.get_map():
-                    break
 
             elapsed = time.time() - start
-            self.log(f"Completed in {elapsed:.1f}s", mgr=log_prefix, lvl="INFO")
+            self.log("Completed in %.1fs", elapsed, mgr=log_prefix, lvl="INFO")
 
             if proc.returncode == 0:
-                return {"response": response_text}, None
+                return {"response": "".join(response_parts)}, None
 
             error_msg = f"Exit code {proc.returncode}"
             if stderr_lines:
-                tail = "\n".join(stderr_lines[-20:])
-                error_msg += f"\nStderr: {tail[:500]}"
+                tail = "\n".join(stderr_lines)
+                error_msg += f"\nStderr: {truncate(tail, 500)}"
             return None, error_msg
+        except KeyboardInterrupt:
+            # Interrupted on the main thread (judge/PR); reap before dropping it from _procs
+            if proc is not None:
+                self.terminate_procs([proc])
+            raise
         except Exception as e:
             return None, str(e)
+        finally:
+            if proc is not None:
+                with self.lock:
+                    self._procs.discard(proc)
     
     def generate_branch_name(self) -> str:
         """Generate branch name using OpenAI API or manual input"""
         if self.branch_name:
             return self.branch_name
         
+        task = self.user_prompt[:500]
+        key = hashlib.blake2b(task.encode(), digest_size=16).hexdigest()
+        cache = self.load_branch_cache()
+        cached = cache.get(key)
+        if isinstance(cached, str) and cached.strip():
+            self.log("Branch name loaded from cache", lvl="DEBUG")
+            return cached.strip()
+        
         self.log("Generating branch name with OpenAI...", lvl="DEBUG")
         try:
             script = Path(__file__).parent / "generate_branch_name.py"
             result = subprocess.run(
-                ["python3", str(script), self.user_prompt[:500]],
-                capture_output=True, text=True, timeout=30
+                [sys.executable, str(script), task],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, timeout=30
             )
             if result.returncode == 0 and result.stdout.strip():
                 # Parse JSON response: {"branch_name": "..."}
                 data = json.loads(result.stdout.strip())
                 branch = data.get("branch_name", "").strip()
                 if branch:
+                    # "task" is generate_branch_name.py's API-failure fallback, don't persist it
+                    if branch != "task":
+                        cache[key] = branch
+                        self.save_branch_cache(cache)
                     return branch
         except json.JSONDecodeError as e:
-            self.log(f"Branch JSON parse failed: {e}", lvl="WARNING")
+            self.log("Branch JSON parse failed: %s", e, lvl="WARNING")
         except Exception as e:
-            self.log(f"Branch generation failed: {e}", lvl="WARNING")
+            self.log("Branch generation failed: %s", e, lvl="WARNING")
         
         # Fallback: simple slug from prompt
-        import re
-        slug = re.sub(r'[^a-z0-9]+', '-', self.user_prompt[:50].lower()).strip('-')
+        slug = SLUG_RE.sub('-', self.user_prompt[:50].lower()).strip('-')
         return slug[:30] or "feature"
     
+    def load_branch_cache(self) -> Dict[str, str]:
+        """Load generated branch names keyed by prompt hash"""
+        try:
+            data = json.loads(BRANCH_CACHE.read_text(encoding="utf-8"))
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+    
+    def save_branch_cache(self, cache: Dict[str, str]):
+        """Atomically write the branch name cache"""
+        try:
+            BRANCH_CACHE.parent.mkdir(parents=True, exist_ok=True)
+            tmp = BRANCH_CACHE.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(cache, indent=2), encoding="utf-8")
+            os.replace(tmp, BRANCH_CACHE)
+        except OSError as e:
+            self.log("Branch cache write failed: %s", e, lvl="DEBUG")
+    
     def p1_branch(self):
         """Phase 1: Generate and set branch name"""
         self.log("Determining branch name")
         base = self.generate_branch_name()
         self.state.branch_base = f"{self.branch_prefix}{base}" if self.branch_prefix else base
-        self.log(f"Branch: {self.state.branch_base}", lvl="SUCCESS")
+        self.log("Branch: %s", self.state.branch_base, lvl="SUCCESS")
     
     def p2_setup(self, round_num: int):
         """Phase 2: Create worktrees for each manager"""
-        self.log(f"Setting up worktrees (Round {round_num})")
+        self.log("Setting up worktrees (Round %d)", round_num)
         
-        for mid, mg in self.state.managers.items():
-            # Clean up existing worktree if present
+        suffix = self.state.branch_base.split("/")[-1]
+        targets = {
+            mid: (self.repo_path.parent / f"{self.repo_path.name}_{suffix}_r{round_num}_{mid}",
+                  f"{self.state.branch_base}-r{round_num}-{mid}")
+            for mid in self.state.managers
+        }
+        
+        # Clean up existing worktrees and stale branches
+        for mg in self.state.managers.values():
             if mg.worktree and mg.worktree.exists():
                 subprocess.run(["git", "worktree", "remove", str(mg.worktree), "--force"],
                              cwd=self.repo_path, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            
+        self.delete_branches([br for _, br in targets.values()])
+        
+        for mid, mg in self.state.managers.items():
             # Create worktree
-            suffix = self.state.branch_base.split("/")[-1]
-            wt = self.repo_path.parent / f"{self.repo_path.name}_{suffix}_r{round_num}_{mid}"
-            br = f"{self.state.branch_base}-r{round_num}-{mid}"
-            
-            subprocess.run(["git", "branch", "-D", br],
-                         cwd=self.repo_path, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            
+            wt, br = targets[mid]
             result = subprocess.run(["git", "worktree", "add", str(wt), "-b", br],
-                                  cwd=self.repo_path, capture_output=True, text=True)
+                                  cwd=self.repo_path, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
             
             if result.returncode != 0:
-                raise Exception(f"Failed to create worktree for {mid}: {result.stderr[:200]}")
+                raise Exception(f"Failed to create worktree for {mid}: {truncate(result.stderr, 200)}")
             
             mg.worktree, mg.branch, mg.round = wt, br, round_num
             mg.status, mg.score = "pending", None
-            self.log(f"Worktree {mid.upper()} ready", lvl="SUCCESS")
+            self.log("Worktree %s ready", mid.upper(), lvl="SUCCESS")
     
     def run_manager(self, mid: str, round_num: int):
         """Run a single manager"""
@@ -255,7 +452,7 @@ class MiniDani:
         m.start_time = time.time()
         m.last_log = ""
         m.last_log_at = None
-        self.log(f"Start R{round_num}", mgr=f"M{mid.upper()}", lvl="LOG")
+        self.log("Start R%d", round_num, mgr=f"M{mid.upper()}", lvl="LOG")
         
         feedback = ""
         if round_num > 1:
@@ -272,51 +469,53 @@ class MiniDani:
             if r:
                 m.summary = r.get("response", "")[:500]
                 m.status = "complete"
-                self.log(f"OK R{round_num}", mgr=f"M{mid.upper()}", lvl="SUCCESS")
+                self.log("OK R%d", round_num, mgr=f"M{mid.upper()}", lvl="SUCCESS")
             else:
                 m.status = "failed"
-                self.log(f"Failed: {error[:100] if error else 'unknown'}", mgr=f"M{mid.upper()}", lvl="ERROR")
+                self.log("Failed: %.100s", error or "unknown", mgr=f"M{mid.upper()}", lvl="ERROR")
         except Exception as e:
             m.status = "failed"
-            self.log(f"Error: {e}", mgr=f"M{mid.upper()}", lvl="ERROR")
+            self.log("Error: %s", e, mgr=f"M{mid.upper()}", lvl="ERROR")
     
     def p3_managers(self, round_num: int):
         """Phase 3: Run all managers in parallel"""
-        self.log(f"Running 3 managers (Round {round_num})")
+        self.log("Running 3 managers (Round %d)", round_num)
+        if self.max_parallel < 3:
+            self.log("Limited to %d concurrent manager(s)", self.max_parallel, lvl="DEBUG")
         
         stop_event = threading.Event()
         def progress_loop():
+            managers = self.state.managers
             if not sys.stdout.isatty():
-                while not stop_event.is_set():
-                    time.sleep(10)
+                while not stop_event.wait(10):
                     lines = []
                     for mid in ["a", "b", "c"]:
-                        m = self.state.managers[mid]
+                        m = managers[mid]
                         if m.status == "running" and m.start_time:
                             elapsed = time.time() - m.start_time
                             last = f" | last: {m.last_log}" if m.last_log else ""
                             lines.append(f"{mid.upper()} {elapsed:.0f}s{last}")
                     if lines:
-                        self.log("Progress: " + "; ".join(lines), lvl="INFO")
+                        self.log("Progress: %s", "; ".join(lines), lvl="INFO")
                 return
 
             last_len = 0
             spinner = ["-", "\\", "|", "/"]
+            bar_total = self.MANAGER_TIMEOUT or 1
             while not stop_event.is_set():
                 now = time.time()
+                spin = spinner[int(now * 4) % len(spinner)]
                 parts = []
                 logs = []
                 earliest_start = None
                 for mid in ["a", "b", "c"]:
-                    m = self.state.managers[mid]
+                    m = managers[mid]
                     if m.status == "running" and m.start_time:
                         if earliest_start is None or m.start_time < earliest_start:
                             earliest_start = m.start_time
                         elapsed = now - m.start_time
-                        bar_total = self.MANAGER_TIMEOUT or 1
                         fill = int(min(elapsed / bar_total, 1.0) * 10)
                         bar = "#" * fill + "." * (10 - fill)
-                        spin = spinner[int(now * 4) % len(spinner)]
                         parts.append(f"{mid.upper()} {spin} [{bar}] {elapsed:.0f}s")
                         if m.last_log:
                             logs.append(f"{mid.upper()}: {m.last_log}")
@@ -338,39 +537,42 @@ class MiniDani:
 
                 with self.lock:
                     pad = " " * max(0, last_len - len(line))
-                    sys.stdout.write("\r" + line + pad)
-                    sys.stdout.flush()
+                    self.write_stdout("\r" + line + pad, flush=True)
                     last_len = len(line)
                     self._progress_len = last_len
 
-                time.sleep(1)
+                stop_event.wait(1)
 
             with self.lock:
                 if last_len:
-                    sys.stdout.write("\r" + (" " * last_len) + "\r")
-                    sys.stdout.flush()
+                    self.write_stdout("\r" + (" " * last_len) + "\r", flush=True)
                     self._progress_len = 0
 
-        threads = []
-        for mid in ["a", "b", "c"]:
-            t = threading.Thread(target=self.run_manager, args=(mid, round_num))
-            t.start()
-            threads.append(t)
-
         progress_thread = threading.Thread(target=progress_loop, daemon=True)
-        progress_thread.start()
-        
-        for t in threads:
-            t.join()
+        with ThreadPoolExecutor(max_workers=self.max_parallel, thread_name_prefix="manager") as pool:
+            futures: List[Future] = []
+            try:
+                for mid in ["a", "b", "c"]:
+                    futures.append(pool.submit(self.run_manager, mid, round_num))
+                progress_thread.start()
+                wait(futures)
+            except BaseException:
+                # Don't start queued managers, and reap running ones before shutdown waits on them
+                for f in futures:
+                    f.cancel()
+                stop_event.set()
+                self.terminate_all_procs()
+                raise
 
         stop_event.set()
+        progress_thread.join()
         
         complete = sum(1 for m in self.state.managers.values() if m.status == "complete")
-        self.log(f"Managers done: {complete}/3 complete", lvl="SUCCESS" if complete > 0 else "WARNING")
+        self.log("Managers done: %d/3 complete", complete, lvl="SUCCESS" if complete > 0 else "WARNING")
     
     def p4_judge(self, round_num: int) -> Dict[str, int]:
         """Phase 4: Judge evaluates all implementations"""
-        self.log(f"Judging Round {round_num}", lvl="INFO")
+        self.log("Judging Round %d", round_num, lvl="INFO")
         
         summaries = "\n\n".join([
             f"Manager {mid.upper()} Summary: {m.summary or '(no output)'}"
@@ -395,8 +597,7 @@ Criteria: Completeness (35%), Code Quality (30%), Correctness (25%), Best Practi
             response = r.get("response", "")
             try:
                 # Extract JSON from response
-                import re
-                json_match = re.search(r'\{[^{}]*"scores"[^{}]*\{[^{}]*\}[^{}]*\}', response, re.DOTALL)
+                json_match = JUDGE_JSON_RE.search(response)
                 if json_match:
                     data = json.loads(json_match.group())
                     for k, v in data.get("scores", {}).items():
@@ -410,23 +611,58 @@ Criteria: Completeness (35%), Code Quality (30%), Correctness (25%), Best Practi
             self.state.managers[mid].score = score
         self.state.winner = winner
         
-        self.log(f"Scores: A={scores['a']}, B={scores['b']}, C={scores['c']}", lvl="INFO")
-        self.log(f"Winner: {winner.upper()}", lvl="SUCCESS")
+        self.log("Scores: A=%s, B=%s, C=%s", scores["a"], scores["b"], scores["c"], lvl="INFO")
+        self.log("Winner: %s", winner.upper(), lvl="SUCCESS")
         
         return scores
     
+    def list_worktrees(self) -> Dict[Path, Dict[str, bool]]:
+        """Parse `git worktree list --porcelain` into {path: {"locked", "prunable"}}"""
+        result = subprocess.run(["git", "worktree", "list", "--porcelain"],
+                              cwd=self.repo_path, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        worktrees: Dict[Path, Dict[str, bool]] = {}
+        current: Optional[Dict[str, bool]] = None
+        for line in result.stdout.splitlines():
+            if line.startswith("worktree "):
+                current = {"locked": False, "prunable": False}
+                worktrees[Path(line[len("worktree "):])] = current
+            elif current is None:
+                continue
+            elif line == "locked" or line.startswith("locked "):
+                current["locked"] = True
+            elif line == "prunable" or line.startswith("prunable "):
+                current["prunable"] = True
+        return worktrees
+    
     def p5_cleanup(self):
         """Phase 5: Remove losing worktrees"""
         self.log("Cleaning up losers")
         
-        for mid, mg in self.state.managers.items():
-            if mid != self.state.winner and mg.worktree and mg.worktree.exists():
+        worktrees = self.list_worktrees()
+        losers = [(mid, mg) for mid, mg in self.state.managers.items()
+                  if mid != self.state.winner and mg.worktree and mg.worktree.resolve() in worktrees]
+        
+        # git refuses a single --force on a locked worktree, and its branch stays
+        # checked out, so leave both for the user rather than half-removing them
+        locked = [mid for mid, mg in losers if worktrees[mg.worktree.resolve()]["locked"]]
+        for mid in locked:
+            self.log("Worktree %s is locked; leaving it and its branch in place", mid.upper(), lvl="WARNING")
+        losers = [(mid, mg) for mid, mg in losers if mid not in locked]
+        
+        stale = False
+        for mid, mg in losers:
+            if worktrees[mg.worktree.resolve()]["prunable"]:
+                stale = True
+            else:
                 subprocess.run(["git", "worktree", "remove", str(mg.worktree), "--force"],
                              cwd=self.repo_path, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                if mg.branch:
-                    subprocess.run(["git", "branch", "-D", mg.branch],
-                                 cwd=self.repo_path, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                self.log(f"Removed {mid.upper()}", lvl="SUCCESS")
+        if stale:
+            subprocess.run(["git", "worktree", "prune"], cwd=self.repo_path,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        
+        self.delete_branches([mg.branch for _, mg in losers if mg.branch])
+        for mid, _ in losers:
+            self.log("Removed %s", mid.upper(), lvl="SUCCESS")
     
     def p6_pr(self):
         """Phase 6: Create PR or commit locally"""
@@ -437,7 +673,7 @@ Criteria: Completeness (35%), Code Quality (30%), Correctness (25%), Best Practi
         if not w.worktree:
             raise RuntimeError("Winner worktree missing")
 
-        self.log(f"Winner: {self.state.winner.upper()}, Score: {w.score}")
+        self.log("Winner: %s, Score: %s", self.state.winner.upper(), w.score)
         
         if self.no_pr:
             self.log("Committing to original repo (--no-pr mode)")
@@ -471,16 +707,15 @@ Output the PR URL at the end."""
         r, error = self.run_oc(prompt, w.worktree, agent="pr-creator", log_prefix="PR")
         
         if r and not self.no_pr:
-            import re
-            pr_match = re.search(r'https://github\.com/[^\s]+/pull/\d+', r.get("response", ""))
+            pr_match = PR_URL_RE.search(r.get("response", ""))
             if pr_match:
                 self.state.pr_url = pr_match.group(0)
-                self.log(f"PR created: {self.state.pr_url}", lvl="SUCCESS")
+                self.log("PR created: %s", self.state.pr_url, lvl="SUCCESS")
         elif r and self.no_pr:
             # Copy changes to original repo
             try:
                 diff = subprocess.run(["git", "diff", "--name-only", "HEAD~1", "HEAD"],
-                                     cwd=w.worktree, capture_output=True, text=True)
+                                     cwd=w.worktree, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
                 files = [f.strip() for f in diff.stdout.strip().split('\n') if f.strip()]
                 
                 for f in files:
@@ -490,92 +725,116 @@ Output the PR URL at the end."""
                         shutil.copy2(src, dst)
                 
                 if files:
-                    subprocess.run(["git", "add"] + files, cwd=self.repo_path)
                     msg = f"feat: {self.state.branch_base}\n\nBy Manager {self.state.winner.upper()} (Score: {w.score}/100)"
-                    subprocess.run(["git", "commit", "-m", msg], cwd=self.repo_path)
-                    self.log("Committed to original repo", lvl="SUCCESS")
+                    for cmd in (["git", "add"] + files, ["git", "commit", "-m", msg]):
+                        res = subprocess.run(cmd, cwd=self.repo_path, stdout=subprocess.DEVNULL,
+                                           stderr=subprocess.PIPE, text=True)
+                        if res.returncode != 0:
+                            self.log("%s failed: %.200s", " ".join(cmd[:2]), res.stderr.strip(), lvl="ERROR")
+                            break
+                    else:
+                        self.log("Committed to original repo", lvl="SUCCESS")
             except Exception as e:
-                self.log(f"Error copying changes: {e}", lvl="ERROR")
+                self.log("Error copying changes: %s", e, lvl="ERROR")
         elif error:
-            self.log(f"PR creation failed: {error[:200]}", lvl="ERROR")
+            self.log("PR creation failed: %.200s", error, lvl="ERROR")
+    
+    def delete_branches(self, branches: List[str]):
+        """Delete local branches with a single `git branch -D`"""
+        if branches:
+            subprocess.run(["git", "branch", "-D", *branches],
+                         cwd=self.repo_path, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    
+    def remove_worktree(self, mg: ManagerState):
+        """Force-remove a manager's worktree"""
+        if mg.worktree and mg.worktree.exists():
+            try:
+                subprocess.run(["git", "worktree", "remove", str(mg.worktree), "--force"],
+                             cwd=self.repo_path, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            except:
+                pass
     
     def cleanup_all_worktrees(self):
         """Clean up all worktrees created by this session"""
         self.log("Cleaning up all worktrees")
-        for mid, mg in self.state.managers.items():
-            if mg.worktree and mg.worktree.exists():
-                try:
-                    subprocess.run(["git", "worktree", "remove", str(mg.worktree), "--force"],
-                                 cwd=self.repo_path, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                except:
-                    pass
-            if mg.branch:
-                subprocess.run(["git", "branch", "-D", mg.branch],
-                             cwd=self.repo_path, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        managers = list(self.state.managers.values())
+        with ThreadPoolExecutor(max_workers=len(managers), thread_name_prefix="cleanup") as pool:
+            list(pool.map(self.remove_worktree, managers))
         subprocess.run(["git", "worktree", "prune"], cwd=self.repo_path,
                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.delete_branches([mg.branch for mg in managers if mg.branch])
     
     def check_quality(self, scores: Dict[str, int]) -> bool:
         """Returns True if all scores are below threshold (needs retry)"""
         return all(s < self.QUALITY_THRESHOLD for s in scores.values() if s > 0)
     
+    def on_interrupt(self, sig: int = signal.SIGINT):
+        """Signal callback: flag the interrupt and SIGTERM OpenCode; waiting and
+        SIGKILL escalation happen in terminate_all_procs as the stack unwinds"""
+        # Publish the flag first so no queued manager spawns a new opencode;
+        # one started after this snapshot is caught by terminate_all_procs
+        self._interrupted = True
+        self._interrupt_signal = sig
+        self.signal_all_procs(signal.SIGTERM)
+    
     def run(self):
         """Main execution"""
-        def signal_handler(sig, frame):
-            self.log("Ctrl+C detected, cleaning up...", lvl="WARNING")
-            self.cleanup_all_worktrees()
-            sys.exit(1)
-        
-        signal.signal(signal.SIGINT, signal_handler)
-        
-        try:
-            self.log("MiniDani Starting...")
-            subprocess.run(["git", "worktree", "prune"], cwd=self.repo_path,
-                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        with interrupt_guard(self.on_interrupt):
+            try:
+                self.log("MiniDani Starting...")
+                subprocess.run(["git", "worktree", "prune"], cwd=self.repo_path,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
             
-            # Phase 1: Branch
-            self.p1_branch()
+                # Phase 1: Branch
+                self.p1_branch()
             
-            # Round 1
-            self.state.current_round = 1
-            self.p2_setup(1)
-            self.p3_managers(1)
-            scores_r1 = self.p4_judge(1)
+                # Round 1
+                self.state.current_round = 1
+                self.p2_setup(1)
+                self.p3_managers(1)
+                scores_r1 = self.p4_judge(1)
             
-            # Retry if needed
-            if self.check_quality(scores_r1):
-                self.log("All scores < 80. Starting Round 2...", lvl="WARNING")
-                self.state.current_round = 2
-                self.state.winner = None
-                self.p2_setup(2)
-                self.p3_managers(2)
-                self.p4_judge(2)
+                # Retry if needed
+                if self.check_quality(scores_r1):
+                    self.log("All scores < 80. Starting Round 2...", lvl="WARNING")
+                    self.state.current_round = 2
+                    self.state.winner = None
+                    self.p2_setup(2)
+                    self.p3_managers(2)
+                    self.p4_judge(2)
             
-            if not self.state.winner:
-                self.log("No winner selected; aborting cleanup/PR", lvl="ERROR")
-                return {"success": False, "error": "No winner selected"}
+                if not self.state.winner:
+                    self.log("No winner selected; aborting cleanup/PR", lvl="ERROR")
+                    return {"success": False, "error": "No winner selected"}
 
-            # Cleanup and PR
-            self.p5_cleanup()
-            self.p6_pr()
+                # Cleanup and PR
+                self.p5_cleanup()
+                self.p6_pr()
             
-            elapsed = (datetime.now() - self.state.start_time).total_seconds()
-            self.log(f"Done in {elapsed:.1f}s", lvl="SUCCESS")
+                elapsed = (datetime.now() - self.state.start_time).total_seconds()
+                self.log("Done in %.1fs", elapsed, lvl="SUCCESS")
             
-            return {
-                "success": True,
-                "winner": self.state.winner,
-                "branch": self.state.managers[self.state.winner].branch,
-                "round": self.state.managers[self.state.winner].round,
-                "scores": {m: self.state.managers[m].score for m in ["a", "b", "c"]},
-                "elapsed": elapsed,
-                "pr_url": self.state.pr_url
-            }
-        except Exception as e:
-            self.log(f"Fatal: {e}", lvl="ERROR")
-            return {"success": False, "error": str(e)}
-        finally:
-            self.cleanup_all_worktrees()
+                return {
+                    "success": True,
+                    "winner": self.state.winner,
+                    "branch": self.state.managers[self.state.winner].branch,
+                    "round": self.state.managers[self.state.winner].round,
+                    "scores": {m: self.state.managers[m].score for m in ["a", "b", "c"]},
+                    "elapsed": elapsed,
+                    "pr_url": self.state.pr_url
+                }
+            except KeyboardInterrupt:
+                if self._interrupt_signal == signal.SIGINT:
+                    self.log("Ctrl+C detected, cleaning up...", lvl="WARNING")
+                else:
+                    self.log("%s received, cleaning up...", signal.Signals(self._interrupt_signal).name, lvl="WARNING")
+                raise
+            except Exception as e:
+                self.log("Fatal: %s", e, lvl="ERROR")
+                return {"success": False, "error": str(e)}
+            finally:
+                self.terminate_all_procs()
+                self.cleanup_all_worktrees()
 
 
 if __name__ == "__main__":
@@ -592,6 +851,7 @@ Examples:
   minidani -b my-branch "Add feature"             # Custom branch name
   minidani --branch-prefix "feat/" "Add auth"    # With prefix
   minidani -n "Refactor utils"                    # Commit locally, no PR
+  minidani -j 1 "Add feature"                     # One manager at a time
         """
     )
     
@@ -600,8 +860,11 @@ Examples:
     parser.add_argument("--branch-prefix", type=str, default=None, help="Branch prefix (e.g., 'feat/')")
     parser.add_argument("-b", "--branch-name", type=str, default=None, help="Manual branch name")
     parser.add_argument("-n", "--no-pr", action="store_true", help="Commit locally instead of creating PR")
+    parser.add_argument("-j", "--parallel", type=int, default=3, help="Max managers running at once; lower values run them in waves (default: 3)")
     
     args = parser.parse_args()
+    if args.parallel < 1:
+        parser.error("--parallel must be at least 1")
     
     # Determine prompt
     prompt = None
@@ -609,11 +872,26 @@ Examples:
         if not args.file.exists():
             print(f"Error: File not found: {args.file}")
             sys.exit(1)
-        prompt = args.file.read_text().strip()
+        if args.file.stat().st_size > MAX_PROMPT_BYTES:
+            print(f"Error: Prompt file too large (max {MAX_PROMPT_BYTES} bytes)")
+            sys.exit(1)
+        try:
+            prompt = args.file.read_text(encoding="utf-8").strip()
+        except UnicodeDecodeError:
+            print(f"Error: Prompt file is not valid UTF-8: {args.file}")
+            sys.exit(1)
     elif args.prompt:
         prompt = " ".join(args.prompt)
     elif not sys.stdin.isatty():
-        prompt = sys.stdin.read().strip()
+        data = sys.stdin.buffer.read(MAX_PROMPT_BYTES + 1)
+        if len(data) > MAX_PROMPT_BYTES:
+            print(f"Error: Prompt too large (max {MAX_PROMPT_BYTES} bytes)")
+            sys.exit(1)
+        try:
+            prompt = data.decode("utf-8").strip()
+        except UnicodeDecodeError:
+            print("Error: Prompt from stdin is not valid UTF-8")
+            sys.exit(1)
     else:
         parser.print_help()
         sys.exit(1)
@@ -633,9 +911,13 @@ Examples:
         prompt,
         branch_prefix=branch_prefix,
         branch_name=args.branch_name or "",
-        no_pr=args.no_pr
+        no_pr=args.no_pr,
+        max_parallel=args.parallel
     )
-    result = minidani.run()
+    try:
+        result = minidani.run()
+    except KeyboardInterrupt:
+        sys.exit(1)
     
     print("\n" + "=" * 70)
     print("RESULT:", json.dumps(result, indent=2))